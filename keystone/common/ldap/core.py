@@ -13,10 +13,11 @@
 # under the License.
 
 import abc
+import itertools
 import os.path
-import re
+import threading
+import time
 
-import codecs
 import ldap
 import ldap.filter
 import six
@@ -41,8 +42,43 @@ LDAP_TLS_CERTS = {'never': ldap.OPT_X_TLS_NEVER,
                   'demand': ldap.OPT_X_TLS_DEMAND,
                   'allow': ldap.OPT_X_TLS_ALLOW}
 
-
-_utf8_encoder = codecs.getencoder('utf-8')
+# Sentinel distinguishing a missing option from a valid falsy value
+# (e.g. LDAP_DEREF maps 'default' to None).
+_MISSING = object()
+
+# The valid-options strings only appear in error messages, but there is
+# no point rebuilding them on every failed parse.
+_LDAP_SCOPES_OPTIONS_STR = ', '.join(sorted(LDAP_SCOPES))
+_LDAP_DEREF_OPTIONS_STR = ', '.join(sorted(LDAP_DEREF))
+_LDAP_TLS_CERTS_OPTIONS_STR = ', '.join(sorted(LDAP_TLS_CERTS))
+
+
+# Bind the six types once; an exact type(value) comparison against
+# these is a C-level pointer check, cheaper than isinstance()'s
+# subclass walk, and nearly every value crossing the LDAP boundary is
+# exactly str/unicode or bytes. isinstance() remains as the fallback
+# for the rare subclass.
+_TEXT = six.text_type
+_BINARY = six.binary_type
+
+# str.isascii() exists from Python 3.7; it reads a flag kept in the
+# compact unicode representation, so it's essentially free and lets
+# pure-ASCII strings (the vast majority of DNs and filters) take the
+# simpler ASCII encoder.
+_text_isascii = getattr(six.text_type, 'isascii', None)
+
+# six.iteritems and friends add a Python-level wrapper call per loop.
+# Binding the unbound dict methods directly gives the same laziness on
+# Python 2 and lets Python 3 iterate the dict views without the extra
+# call on every hot loop in this module.
+if six.PY2:
+    _iteritems = dict.iteritems
+    _itervalues = dict.itervalues
+    _iterkeys = dict.iterkeys
+else:
+    _iteritems = dict.items
+    _itervalues = dict.values
+    _iterkeys = dict.keys
 
 
 def utf8_encode(value):
@@ -55,15 +91,35 @@ def utf8_encode(value):
     :returns: UTF-8 encoded version of value
     :raises: TypeError if value is not basestring
     """
-    if isinstance(value, six.text_type):
-        return _utf8_encoder(value)[0]
-    elif isinstance(value, six.binary_type):
+    value_type = type(value)
+    if value_type is _TEXT:
+        if _text_isascii is not None and _text_isascii(value):
+            return value.encode('ascii')
+        return value.encode('utf-8')
+    elif value_type is _BINARY:
+        return value
+    elif isinstance(value, _TEXT):
+        return value.encode('utf-8')
+    elif isinstance(value, _BINARY):
         return value
     else:
         raise TypeError("value must be basestring, "
                         "not %s" % value.__class__.__name__)
 
-_utf8_decoder = codecs.getdecoder('utf-8')
+
+def _utf8_encode_text(value):
+    """Encode a value known to be text to UTF-8.
+
+    A trimmed-down utf8_encode for call sites where the value has just
+    come out of py2ldap and is therefore guaranteed to be text, so the
+    type dispatch can be skipped. Nearly all LDAP values are
+    ASCII-only and the ASCII codec is the fastest encoder available,
+    so try it first and fall back to UTF-8 (a superset) for the rest.
+    """
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value.encode('utf-8')
 
 
 def utf8_decode(value):
@@ -77,9 +133,19 @@ def utf8_decode(value):
     :returns: value as unicode
     :raises: UnicodeDecodeError for invalid UTF-8 encoding
     """
-    if isinstance(value, six.binary_type):
-        return _utf8_decoder(value)[0]
-    return six.text_type(value)
+    if type(value) is _BINARY or isinstance(value, _BINARY):
+        return value.decode('utf-8')
+    return _TEXT(value)
+
+
+def _py2ldap_bool(val):
+    return u'TRUE' if val else u'FALSE'
+
+
+# Dispatch on exact type; a dict lookup on type(val) is cheaper than an
+# isinstance() check per value and leaves room for other special-cased
+# types. Anything not listed falls back to six.text_type.
+_PY2LDAP_CONVERTERS = {bool: _py2ldap_bool}
 
 
 def py2ldap(val):
@@ -93,10 +159,10 @@ def py2ldap(val):
     :param val: The value to convert to a LDAP string representation
     :returns: unicode string representation of value.
     """
-    if isinstance(val, bool):
-        return u'TRUE' if val else u'FALSE'
-    else:
-        return six.text_type(val)
+    converter = _PY2LDAP_CONVERTERS.get(type(val))
+    if converter is not None:
+        return converter(val)
+    return six.text_type(val)
 
 
 def ldap2py(val):
@@ -109,17 +175,46 @@ def ldap2py(val):
     :param val: LDAP formatted value
     :returns: val converted to preferred Python type
     """
-    try:
-        return LDAP_VALUES[val]
-    except KeyError:
-        pass
-    try:
-        return int(val)
-    except ValueError:
-        pass
+    # Most values are plain strings that are neither boolean literals
+    # nor integers, so test membership and digits explicitly instead of
+    # raising and catching KeyError/ValueError for every value. int()
+    # still has the final say: it tolerates surrounding whitespace
+    # (hence the strip before probing), while isdigit() is true for
+    # digit-like characters such as superscripts that int() rejects.
+    py_value = LDAP_VALUES.get(val)
+    if py_value is not None:
+        return py_value
+    probe = val.strip()
+    if probe[:1] in ('-', '+'):
+        probe = probe[1:]
+    if probe.isdigit():
+        try:
+            return int(val)
+        except ValueError:
+            pass
     return utf8_decode(val)
 
 
+class _CIDict(dict):
+    """A dict with case-insensitive lookup of its string keys.
+
+    LDAP attribute names are case-insensitive and servers may return
+    them in a different case than the one used in the query or in the
+    configured mappings. Keys are stored lowercased and lookups fold
+    their argument, so consumers can index with whatever case their
+    configuration uses without rebuilding a lowercased copy per entry.
+    """
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+
 def convert_ldap_result(ldap_result):
     """Convert LDAP search result to Python types used by OpenStack.
 
@@ -135,20 +230,56 @@ def convert_ldap_result(ldap_result):
 
     :param ldap_result: LDAP search result
     :returns: list of 2-tuples containing (dn, attrs) where dn is unicode
-              and attrs is a dict whose values are type converted to
-              OpenStack preferred types.
+              and attrs is a case-insensitive dict whose values are type
+              converted to OpenStack preferred types.
     """
+    # NOTE: generating a converter specialized to each driver's fixed
+    # attribute list (instead of iterating whatever dict the server
+    # returned) was considered and rejected: servers may legitimately
+    # return attributes outside the configured list, and dynamically
+    # exec'ing code has no precedent in this tree. The generic loop
+    # below is already free of per-value exception overhead.
     py_result = []
     at_least_one_referral = False
+    # Bind the hot names to locals; the loop below runs per attribute
+    # value over potentially thousands of entries and a LOAD_FAST is
+    # cheaper than a global or method lookup each time.
+    ldap_values_get = LDAP_VALUES.get
+    decode = utf8_decode
+    py_result_append = py_result.append
     for dn, attrs in ldap_result:
         if dn is None:
             # this is a Referral object, rather than an Entry object
             at_least_one_referral = True
             continue
 
-        py_result.append((utf8_decode(dn),
-                          dict((kind, [ldap2py(x) for x in values])
-                               for kind, values in six.iteritems(attrs))))
+        py_attrs = _CIDict()
+        for kind, values in attrs.items():
+            converted = []
+            converted_append = converted.append
+            for x in values:
+                # Inline the common cases of ldap2py: most values are
+                # plain strings that are neither 'TRUE'/'FALSE' nor
+                # integers, so decide with cheap checks rather than
+                # raising and catching KeyError/ValueError per value.
+                # As in ldap2py, int() keeps the final say over the
+                # isdigit() probe.
+                py_value = ldap_values_get(x)
+                if py_value is not None:
+                    converted_append(py_value)
+                    continue
+                probe = x.strip()
+                if probe[:1] in ('-', '+'):
+                    probe = probe[1:]
+                if probe.isdigit():
+                    try:
+                        converted_append(int(x))
+                        continue
+                    except ValueError:
+                        pass
+                converted_append(decode(x))
+            py_attrs[kind.lower()] = converted
+        py_result_append((decode(dn), py_attrs))
     if at_least_one_referral:
         LOG.debug(('Referrals were returned and ignored. Enable referral '
                    'chasing in keystone.conf via [ldap] chase_referrals'))
@@ -157,55 +288,142 @@ def convert_ldap_result(ldap_result):
 
 
 def safe_iter(attrs):
+    # Return a plain sequence rather than being a generator; callers
+    # only ever iterate the result and this avoids setting up a
+    # generator frame for every attribute in add_s/modify_s.
     if attrs is None:
-        return
+        return ()
     elif isinstance(attrs, list):
-        for e in attrs:
-            yield e
+        return attrs
     else:
-        yield attrs
+        return (attrs,)
 
 
-def parse_deref(opt):
+# Searches are issued with the same base DN, filter and attribute list
+# over and over (one fixed query shape per entity type), so cache the
+# UTF-8 encoded forms of the arguments.
+_SEARCH_ARGS_CACHE_MAXSIZE = 512
+_search_args_cache = {}
+
+
+def _encode_search_args(base, filterstr, attrlist):
+    """UTF-8 encode search arguments, memoizing the encoded forms.
+
+    None singletons are filtered out of the attribute list in the same
+    pass that encodes it. The attribute list is cached as a tuple but
+    returned as a fresh list each call, since python-ldap is handed a
+    mutable sequence.
+    """
+    key = (base, filterstr,
+           tuple(attrlist) if attrlist is not None else None)
     try:
-        return LDAP_DEREF[opt]
+        base_utf8, filterstr_utf8, attrlist_utf8 = _search_args_cache[key]
     except KeyError:
+        base_utf8 = utf8_encode(base)
+        filterstr_utf8 = utf8_encode(filterstr)
+        if attrlist is None:
+            attrlist_utf8 = None
+        else:
+            attrlist_utf8 = tuple(utf8_encode(attr) for attr in attrlist
+                                  if attr is not None)
+        if len(_search_args_cache) < _SEARCH_ARGS_CACHE_MAXSIZE:
+            _search_args_cache[key] = (base_utf8, filterstr_utf8,
+                                       attrlist_utf8)
+    if attrlist_utf8 is None:
+        return base_utf8, filterstr_utf8, None
+    return base_utf8, filterstr_utf8, list(attrlist_utf8)
+
+
+def parse_deref(opt):
+    deref = LDAP_DEREF.get(opt, _MISSING)
+    if deref is _MISSING:
         raise ValueError(_('Invalid LDAP deref option: %(option)s. '
                            'Choose one of: %(options)s') %
                          {'option': opt,
-                          'options': ', '.join(LDAP_DEREF.keys()), })
+                          'options': _LDAP_DEREF_OPTIONS_STR, })
+    return deref
 
 
 def parse_tls_cert(opt):
-    try:
-        return LDAP_TLS_CERTS[opt]
-    except KeyError:
+    tls_cert = LDAP_TLS_CERTS.get(opt, _MISSING)
+    if tls_cert is _MISSING:
         raise ValueError(_(
             'Invalid LDAP TLS certs option: %(option)s. '
             'Choose one of: %(options)s') % {
                 'option': opt,
-                'options': ', '.join(LDAP_TLS_CERTS.keys())})
+                'options': _LDAP_TLS_CERTS_OPTIONS_STR})
+    return tls_cert
 
 
 def ldap_scope(scope):
-    try:
-        return LDAP_SCOPES[scope]
-    except KeyError:
+    scope_value = LDAP_SCOPES.get(scope, _MISSING)
+    if scope_value is _MISSING:
         raise ValueError(
             _('Invalid LDAP scope: %(scope)s. Choose one of: %(options)s') % {
                 'scope': scope,
-                'options': ', '.join(LDAP_SCOPES.keys())})
+                'options': _LDAP_SCOPES_OPTIONS_STR})
+    return scope_value
+
+
+if hasattr(six.text_type, 'casefold'):
+    def _casefold(value):
+        return value.casefold()
+else:
+    # Python 2 has no casefold(); lower() is the closest available
+    # approximation of RFC4518 case folding there.
+    def _casefold(value):
+        return value.lower()
+
+
+# DN comparisons tend to see the same attribute values (OUs, domain
+# components) over and over, so memoize the prepared form. Once the cache
+# is full new values are simply not cached, which keeps the memory use
+# bounded without any eviction bookkeeping.
+_PREP_CACHE_MAXSIZE = 4096
+_prep_cache = {}
 
 
 def prep_case_insensitive(value):
     """Prepare a string for case-insensitive comparison.
 
     This is defined in RFC4518. For simplicity, all this function does is
-    lowercase all the characters, strip leading and trailing whitespace,
-    and compress sequences of spaces to a single space.
+    fold the case of all the characters, strip leading and trailing
+    whitespace, and compress sequences of spaces to a single space.
+
+    Results are memoized since DN comparisons repeatedly prepare the same
+    attribute values.
     """
-    value = re.sub(r'\s+', ' ', value.strip().lower())
-    return value
+    try:
+        return _prep_cache[value]
+    except KeyError:
+        pass
+    # NOTE: str.split() with no arguments already strips leading and
+    # trailing whitespace and folds runs of whitespace, so the whole
+    # normalization is done in a single pass without the regex engine.
+    prepped = ' '.join(_casefold(value).split())
+    if len(_prep_cache) < _PREP_CACHE_MAXSIZE:
+        _prep_cache[value] = prepped
+    return prepped
+
+
+# DN strings compared by the authorization paths repeat heavily (the
+# same user/group DNs get checked against the same subtree DNs), so
+# memoize the parsed form. The parse is stored as nested tuples so the
+# cached value is immutable and can safely be shared between callers.
+_STR2DN_CACHE_MAXSIZE = 2048
+_str2dn_cache = {}
+
+
+def _str2dn(dn_str):
+    """Parse a DN string with ldap.dn.str2dn, memoizing the result."""
+    try:
+        return _str2dn_cache[dn_str]
+    except KeyError:
+        pass
+    parsed = tuple(tuple(rdn) for rdn in ldap.dn.str2dn(dn_str))
+    if len(_str2dn_cache) < _STR2DN_CACHE_MAXSIZE:
+        _str2dn_cache[dn_str] = parsed
+    return parsed
 
 
 def is_ava_value_equal(attribute_type, val1, val2):
@@ -243,17 +461,17 @@ def is_rdn_equal(rdn1, rdn2):
     if len(rdn1) != len(rdn2):
         return False
 
-    for attr_type_1, val1, dummy in rdn1:
-        found = False
-        for attr_type_2, val2, dummy in rdn2:
-            if attr_type_1.lower() != attr_type_2.lower():
-                continue
+    # Index rdn2 by lowercased attribute type so each AVA in rdn1 is
+    # matched with a single dict lookup rather than a linear scan, and
+    # each attribute type is lowercased only once.
+    rdn2_avas = dict((attr_type.lower(), val)
+                     for attr_type, val, dummy in rdn2)
 
-            found = True
-            if not is_ava_value_equal(attr_type_1, val1, val2):
-                return False
-            break
-        if not found:
+    for attr_type_1, val1, dummy in rdn1:
+        val2 = rdn2_avas.get(attr_type_1.lower())
+        if val2 is None:
+            return False
+        if not is_ava_value_equal(attr_type_1, val1, val2):
             return False
 
     return True
@@ -273,10 +491,16 @@ def is_dn_equal(dn1, dn2):
 
     """
 
-    if not isinstance(dn1, list):
-        dn1 = ldap.dn.str2dn(dn1)
-    if not isinstance(dn2, list):
-        dn2 = ldap.dn.str2dn(dn2)
+    # Two equal values (string or parsed) are trivially the same DN, a
+    # common case when a DN returned by the server is compared against
+    # the very string it was built from. Skip parsing entirely.
+    if dn1 == dn2:
+        return True
+
+    if isinstance(dn1, six.string_types):
+        dn1 = _str2dn(dn1)
+    if isinstance(dn2, six.string_types):
+        dn2 = _str2dn(dn2)
 
     if len(dn1) != len(dn2):
         return False
@@ -295,10 +519,15 @@ def dn_startswith(descendant_dn, dn):
 
     """
 
-    if not isinstance(descendant_dn, list):
-        descendant_dn = ldap.dn.str2dn(descendant_dn)
-    if not isinstance(dn, list):
-        dn = ldap.dn.str2dn(dn)
+    # Equal values denote the same DN, which is never strictly under
+    # itself, so don't bother parsing.
+    if descendant_dn == dn:
+        return False
+
+    if isinstance(descendant_dn, six.string_types):
+        descendant_dn = _str2dn(descendant_dn)
+    if isinstance(dn, six.string_types):
+        dn = _str2dn(dn)
 
     if len(descendant_dn) <= len(dn):
         return False
@@ -457,6 +686,10 @@ class LDAPHandler(object):
     def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
         raise exception.NotImplemented()  # pragma: no cover
 
+    @abc.abstractmethod
+    def compare_s(self, dn, attr, value):
+        raise exception.NotImplemented()  # pragma: no cover
+
 
 class PythonLDAPHandler(LDAPHandler):
     '''Implementation of the LDAPHandler interface which calls the
@@ -580,6 +813,9 @@ class PythonLDAPHandler(LDAPHandler):
     def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
         return self.conn.delete_ext_s(dn, serverctrls, clientctrls)
 
+    def compare_s(self, dn, attr, value):
+        return self.conn.compare_s(dn, attr, value)
+
 
 class KeystoneLDAPHandler(LDAPHandler):
     '''Convert data types and perform logging.
@@ -610,6 +846,10 @@ class KeystoneLDAPHandler(LDAPHandler):
     def __init__(self, conn=None):
         super(KeystoneLDAPHandler, self).__init__(conn=conn)
         self.page_size = 0
+        # Set by BaseLdap.get_connection for poolable connections; when
+        # set, unbind_s returns the connection to the pool instead of
+        # closing it.
+        self._pool_key = None
 
     def _disable_paging(self):
         # Disable the pagination from now on
@@ -618,6 +858,7 @@ class KeystoneLDAPHandler(LDAPHandler):
     def connect(self, url, page_size=0, alias_dereferencing=None,
                 use_tls=False, tls_cacertfile=None, tls_cacertdir=None,
                 tls_req_cert='demand', chase_referrals=None, debug_level=None):
+        self.page_size = page_size
         return self.conn.connect(url, page_size, alias_dereferencing,
                                  use_tls, tls_cacertfile, tls_cacertdir,
                                  tls_req_cert, chase_referrals,
@@ -638,21 +879,31 @@ class KeystoneLDAPHandler(LDAPHandler):
                                        serverctrls, clientctrls)
 
     def unbind_s(self):
+        if self._pool_key is not None:
+            # Pooled connection: check it back in for reuse rather than
+            # tearing down the TCP/TLS session and bind.
+            _pool_checkin(self._pool_key, self)
+            return
         LOG.debug("LDAP unbind")
         return self.conn.unbind_s()
 
     def add_s(self, dn, modlist):
-        ldap_attrs = [(kind, [py2ldap(x) for x in safe_iter(values)])
-                      for kind, values in modlist]
-        logging_attrs = [(kind, values
-                         if kind != 'userPassword'
-                         else ['****'])
-                         for kind, values in ldap_attrs]
+        # Build the UTF-8 encoded attributes and the password-filtered
+        # logging view in a single pass over the values rather than
+        # materializing an intermediate unicode modlist and walking it
+        # again.
+        ldap_attrs_utf8 = []
+        logging_attrs = []
+        for kind, values in modlist:
+            ldap_values = [py2ldap(x) for x in safe_iter(values)]
+            logging_attrs.append((kind, ldap_values
+                                  if kind != 'userPassword'
+                                  else ['****']))
+            ldap_attrs_utf8.append(
+                (kind, [_utf8_encode_text(x) for x in ldap_values]))
         LOG.debug('LDAP add: dn=%s attrs=%s',
                   dn, logging_attrs)
         dn_utf8 = utf8_encode(dn)
-        ldap_attrs_utf8 = [(kind, [utf8_encode(x) for x in safe_iter(values)])
-                           for kind, values in ldap_attrs]
         return self.conn.add_s(dn_utf8, ldap_attrs_utf8)
 
     def search_s(self, base, scope,
@@ -670,12 +921,8 @@ class KeystoneLDAPHandler(LDAPHandler):
             ldap_result = self._paged_search_s(base, scope,
                                                filterstr, attrlist)
         else:
-            base_utf8 = utf8_encode(base)
-            filterstr_utf8 = utf8_encode(filterstr)
-            if attrlist is None:
-                attrlist_utf8 = None
-            else:
-                attrlist_utf8 = map(utf8_encode, attrlist)
+            base_utf8, filterstr_utf8, attrlist_utf8 = _encode_search_args(
+                base, filterstr, attrlist)
             ldap_result = self.conn.search_s(base_utf8, scope,
                                              filterstr_utf8,
                                              attrlist_utf8, attrsonly)
@@ -684,6 +931,63 @@ class KeystoneLDAPHandler(LDAPHandler):
 
         return py_result
 
+    def search_s_iter(self, base, scope,
+                      filterstr='(objectClass=*)', attrlist=None):
+        """Stream converted search results one entry at a time.
+
+        Like search_s, but yields (dn, attrs) tuples as each page
+        arrives from the server instead of buffering the complete
+        result list, so callers iterating large result sets hold at
+        most one page in memory. Without paging configured the whole
+        result still arrives in one response; it is then just iterated.
+        """
+        if attrlist is not None:
+            attrlist = [attr for attr in attrlist if attr is not None]
+        LOG.debug('LDAP search_s_iter: base=%s scope=%s filterstr=%s '
+                  'attrs=%s', base, scope, filterstr, attrlist)
+        base_utf8, filterstr_utf8, attrlist_utf8 = _encode_search_args(
+            base, filterstr, attrlist)
+        if not self.page_size:
+            ldap_result = self.conn.search_s(base_utf8, scope,
+                                             filterstr_utf8,
+                                             attrlist_utf8)
+            for entry in convert_ldap_result(ldap_result):
+                yield entry
+            return
+        page_oid = ldap.LDAP_CONTROL_PAGE_OID
+        lc = ldap.controls.SimplePagedResultsControl(
+            controlType=page_oid,
+            criticality=True,
+            controlValue=(self.page_size, ''))
+        search_ext = self.conn.search_ext
+        result3 = self.conn.result3
+        msgid = search_ext(base_utf8,
+                           scope,
+                           filterstr_utf8,
+                           attrlist_utf8,
+                           serverctrls=[lc])
+        while True:
+            rtype, rdata, rmsgid, serverctrls = result3(msgid)
+            for entry in convert_ldap_result(rdata):
+                yield entry
+            pctrl = next((c for c in serverctrls
+                          if c.controlType == page_oid), None)
+            if pctrl is None:
+                LOG.warning(_('LDAP Server does not support paging. '
+                              'Disable paging in keystone.conf to '
+                              'avoid this message.'))
+                self._disable_paging()
+                break
+            est, cookie = pctrl.controlValue
+            if not cookie:
+                break
+            lc.controlValue = (self.page_size, cookie)
+            msgid = search_ext(base_utf8,
+                               scope,
+                               filterstr_utf8,
+                               attrlist_utf8,
+                               serverctrls=[lc])
+
     def search_ext(self, base, scope,
                    filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
                    serverctrls=None, clientctrls=None,
@@ -702,42 +1006,46 @@ class KeystoneLDAPHandler(LDAPHandler):
 
     def _paged_search_s(self, base, scope, filterstr, attrlist=None):
         res = []
+        page_oid = ldap.LDAP_CONTROL_PAGE_OID
         lc = ldap.controls.SimplePagedResultsControl(
-            controlType=ldap.LDAP_CONTROL_PAGE_OID,
+            controlType=page_oid,
             criticality=True,
             controlValue=(self.page_size, ''))
-        base_utf8 = utf8_encode(base)
-        filterstr_utf8 = utf8_encode(filterstr)
-        if attrlist is None:
-            attrlist_utf8 = None
-        else:
-            attrlist = [attr for attr in attrlist if attr is not None]
-            attrlist_utf8 = map(utf8_encode, attrlist)
-        msgid = self.conn.search_ext(base_utf8,
-                                     scope,
-                                     filterstr_utf8,
-                                     attrlist_utf8,
-                                     serverctrls=[lc])
+        base_utf8, filterstr_utf8, attrlist_utf8 = _encode_search_args(
+            base, filterstr, attrlist)
+        # Bind the methods used once per page to locals so the loop
+        # doesn't resolve them through self.conn on each iteration.
+        search_ext = self.conn.search_ext
+        result3 = self.conn.result3
+        res_extend = res.extend
+        msgid = search_ext(base_utf8,
+                           scope,
+                           filterstr_utf8,
+                           attrlist_utf8,
+                           serverctrls=[lc])
         # Endless loop request pages on ldap server until it has no data
         while True:
             # Request to the ldap server a page with 'page_size' entries
-            rtype, rdata, rmsgid, serverctrls = self.conn.result3(msgid)
+            rtype, rdata, rmsgid, serverctrls = result3(msgid)
             # Receive the data
-            res.extend(rdata)
-            pctrls = [c for c in serverctrls
-                      if c.controlType == ldap.LDAP_CONTROL_PAGE_OID]
-            if pctrls:
+            res_extend(rdata)
+            # Only the first matching control matters, so stop scanning
+            # serverctrls as soon as it's found instead of building a
+            # list of all matches on every page.
+            pctrl = next((c for c in serverctrls
+                          if c.controlType == page_oid), None)
+            if pctrl is not None:
                 # LDAP server supports pagination
-                est, cookie = pctrls[0].controlValue
+                est, cookie = pctrl.controlValue
                 if cookie:
                     # There is more data still on the server
                     # so we request another page
                     lc.controlValue = (self.page_size, cookie)
-                    msgid = self.conn.search_ext(base_utf8,
-                                                 scope,
-                                                 filterstr_utf8,
-                                                 attrlist_utf8,
-                                                 serverctrls=[lc])
+                    msgid = search_ext(base_utf8,
+                                       scope,
+                                       filterstr_utf8,
+                                       attrlist_utf8,
+                                       serverctrls=[lc])
                 else:
                     # Exit condition no more data on server
                     break
@@ -761,22 +1069,36 @@ class KeystoneLDAPHandler(LDAPHandler):
         return py_result
 
     def modify_s(self, dn, modlist):
-        ldap_modlist = [
-            (op, kind, (None if values is None
-                        else [py2ldap(x) for x in safe_iter(values)]))
-            for op, kind, values in modlist]
-
-        logging_modlist = [(op, kind, (values if kind != 'userPassword'
-                           else ['****']))
-                           for op, kind, values in ldap_modlist]
+        # Convert each value to unicode and to UTF-8 in one pass over
+        # the modlist, deriving the password-filtered logging view from
+        # the same loop, instead of three separate comprehensions each
+        # re-walking every value.
+        ldap_modlist_utf8 = []
+        logging_modlist = []
+        # Bind the per-value converters to locals; modlists from
+        # membership syncs can carry thousands of values and LOAD_FAST
+        # beats a global lookup per value.
+        _convert = py2ldap
+        _enc = _utf8_encode_text
+        for op, kind, values in modlist:
+            if values is None:
+                ldap_values = None
+                ldap_values_utf8 = None
+            else:
+                # Values are almost always already a list or tuple, so
+                # only fall back to safe_iter for scalars.
+                if not isinstance(values, (list, tuple)):
+                    values = safe_iter(values)
+                ldap_values = [_convert(x) for x in values]
+                ldap_values_utf8 = [_enc(x) for x in ldap_values]
+            logging_modlist.append((op, kind, ldap_values
+                                    if kind != 'userPassword'
+                                    else ['****']))
+            ldap_modlist_utf8.append((op, kind, ldap_values_utf8))
         LOG.debug('LDAP modify: dn=%s modlist=%s',
                   dn, logging_modlist)
 
         dn_utf8 = utf8_encode(dn)
-        ldap_modlist_utf8 = [
-            (op, kind, (None if values is None
-                        else [utf8_encode(x) for x in safe_iter(values)]))
-            for op, kind, values in ldap_modlist]
         return self.conn.modify_s(dn_utf8, ldap_modlist_utf8)
 
     def delete_s(self, dn):
@@ -790,6 +1112,102 @@ class KeystoneLDAPHandler(LDAPHandler):
         dn_utf8 = utf8_encode(dn)
         return self.conn.delete_ext_s(dn_utf8, serverctrls, clientctrls)
 
+    def compare_s(self, dn, attr, value):
+        LOG.debug('LDAP compare: dn=%s attr=%s', dn, attr)
+        dn_utf8 = utf8_encode(dn)
+        attr_utf8 = utf8_encode(attr)
+        value_utf8 = utf8_encode(py2ldap(value))
+        return self.conn.compare_s(dn_utf8, attr_utf8, value_utf8)
+
+
+# Pool of live connections bound as the service account, keyed by the
+# connection configuration (URL, service user and TLS settings; never
+# end-user credentials -- see BaseLdap.get_connection). Opening an LDAP
+# connection pays a TCP connect, an optional TLS handshake and a bind
+# round-trip, which dwarfs the cost of the actual search or modify for
+# most operations, so connections are reused rather than unbound.
+# KeystoneLDAPHandler.unbind_s checks pooled connections back in, which
+# keeps every existing "finally: conn.unbind_s()" call site working
+# unchanged.
+_POOL_MAXSIZE = 10
+
+# Pooled connections that sit idle longer than this are torn down the
+# next time the pool is touched instead of being reused, so a burst of
+# traffic doesn't leave sockets open forever.
+_POOL_IDLE_TTL = 600
+
+_conn_pools = {}
+_conn_pools_lock = threading.Lock()
+
+
+def _pool_unbind(conn):
+    """Really unbind a connection that is leaving the pool for good."""
+    conn._pool_key = None
+    try:
+        conn.unbind_s()
+    except ldap.LDAPError:
+        pass
+
+
+def _pool_reap_locked(pool, now):
+    """Pop entries that idled past the TTL; the caller closes them.
+
+    Checkins append to the end and checkouts pop from the end, so the
+    stalest entries sit at the front and the scan can stop at the
+    first fresh one. The caller must hold _conn_pools_lock; the
+    returned connections are unbound outside it.
+    """
+    expired = []
+    while pool and now - pool[0][1] >= _POOL_IDLE_TTL:
+        expired.append(pool.pop(0)[0])
+    return expired
+
+
+def _pool_checkout(pool_key):
+    """Return a pooled connection for pool_key, or None if none is usable.
+
+    Idle connections are probed with a cheap root DSE read before being
+    handed out; connections that died or idled out while pooled are
+    discarded.
+    """
+    while True:
+        with _conn_pools_lock:
+            pool = _conn_pools.get(pool_key)
+            expired = _pool_reap_locked(pool, time.time()) if pool else []
+            conn = pool.pop()[0] if pool else None
+            if pool is not None and not pool:
+                # Drop exhausted keys so the module-level dict doesn't
+                # accumulate an entry per configuration ever seen.
+                del _conn_pools[pool_key]
+        for old in expired:
+            _pool_unbind(old)
+        if conn is None:
+            return None
+        try:
+            # RFC 4511: an attribute list of just "1.1" requests no
+            # attributes, making this the cheapest possible liveness
+            # probe.
+            conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+        except ldap.LDAPError:
+            _pool_unbind(conn)
+        else:
+            return conn
+
+
+def _pool_checkin(pool_key, conn):
+    now = time.time()
+    with _conn_pools_lock:
+        pool = _conn_pools.setdefault(pool_key, [])
+        expired = _pool_reap_locked(pool, now)
+        if len(pool) < _POOL_MAXSIZE:
+            pool.append((conn, now))
+            conn = None
+    for old in expired:
+        _pool_unbind(old)
+    if conn is not None:
+        # The pool is full; tear this connection down for real.
+        _pool_unbind(conn)
+
 
 _HANDLERS = {}
 
@@ -799,9 +1217,17 @@ def register_handler(prefix, handler):
 
 
 def _get_connection(conn_url):
-    for prefix, handler in six.iteritems(_HANDLERS):
-        if conn_url.startswith(prefix):
+    if _HANDLERS:
+        # Handlers are registered with '<scheme>://' prefixes, so a
+        # direct lookup on the URL scheme resolves them without
+        # scanning.  Prefixes of any other shape (nothing in-tree
+        # registers one) still take the scan below.
+        handler = _HANDLERS.get(conn_url.split('://', 1)[0] + '://')
+        if handler is not None:
             return handler()
+        for prefix, handler in _iteritems(_HANDLERS):
+            if conn_url.startswith(prefix):
+                return handler()
 
     return PythonLDAPHandler()
 
@@ -821,6 +1247,55 @@ def filter_entity(entity_ref):
     return entity_ref
 
 
+# When the query scope is not onelevel, _id_to_dn resolves an id to its
+# DN with a subtree search, and it runs several times per user-visible
+# operation. DNs only change when an entry is deleted and recreated, so
+# the resolution is cached per backend instance with a TTL that bounds
+# staleness from out-of-band directory edits.
+_DN_CACHE_MAXSIZE = 4096
+_DN_CACHE_TTL = 3600
+
+# Parsed additional-attribute mappings keyed by the configured option
+# list; the same few lists are re-parsed at every backend
+# instantiation.
+_EXTRA_ATTRS_CACHE_MAXSIZE = 64
+_extra_attrs_cache = {}
+
+
+def _calc_filter(attrname, value):
+    val_esc = ldap.filter.escape_filter_chars(value)
+    return '(%s=%s)' % (attrname, val_esc)
+
+
+# escape_dn_chars/escape_filter_chars are pure functions of their input
+# and the read paths escape the same object ids over and over (the
+# enabled-emulation helpers alone escape one id several times per
+# operation), so memoize the escaped forms.
+_ESCAPE_CACHE_MAXSIZE = 4096
+_escape_dn_cache = {}
+_escape_filter_cache = {}
+
+
+def _escape_dn_chars(value):
+    try:
+        return _escape_dn_cache[value]
+    except KeyError:
+        escaped = ldap.dn.escape_dn_chars(value)
+        if len(_escape_dn_cache) < _ESCAPE_CACHE_MAXSIZE:
+            _escape_dn_cache[value] = escaped
+        return escaped
+
+
+def _escape_filter_chars(value):
+    try:
+        return _escape_filter_cache[value]
+    except KeyError:
+        escaped = ldap.filter.escape_filter_chars(value)
+        if len(_escape_filter_cache) < _ESCAPE_CACHE_MAXSIZE:
+            _escape_filter_cache[value] = escaped
+        return escaped
+
+
 class BaseLdap(object):
     DEFAULT_SUFFIX = "dc=example,dc=com"
     DEFAULT_OU = None
@@ -853,6 +1328,13 @@ class BaseLdap(object):
         self.attribute_mapping = {}
         self.chase_referrals = conf.ldap.chase_referrals
         self.debug_level = conf.ldap.debug_level
+        self._dn_cache = {}
+        self._search_attrlist = None
+        self._model_projection = []
+        self._get_filter_tmpl = None
+        self._get_all_filter_tmpl = None
+        self._id_to_dn_filter_tmpl = None
+        self._get_by_name_filter_tmpl = None
 
         if self.options_name is not None:
             self.suffix = conf.ldap.suffix
@@ -869,7 +1351,7 @@ class BaseLdap(object):
             self.object_class = (getattr(conf.ldap, objclass)
                                  or self.DEFAULT_OBJECTCLASS)
 
-            for k, v in six.iteritems(self.attribute_options_names):
+            for k, v in _iteritems(self.attribute_options_names):
                 v = '%s_%s_attribute' % (self.options_name, v)
                 self.attribute_mapping[k] = getattr(conf.ldap, v)
 
@@ -903,6 +1385,37 @@ class BaseLdap(object):
             attribute_ignore = '%s_attribute_ignore' % self.options_name
             self.attribute_ignore = getattr(conf.ldap, attribute_ignore)
 
+            # The attributes to request in searches and the model-key to
+            # LDAP-attribute pairs used to map results back are fixed once
+            # the mappings above are loaded, so compute them here instead
+            # of on every query.
+            self._search_attrlist = tuple(set(itertools.chain(
+                _itervalues(self.attribute_mapping),
+                _iterkeys(self.extra_attr_mapping))))
+            if self.model is not None:
+                for k in self.model.required_keys + self.model.optional_keys:
+                    if k in self.attribute_ignore:
+                        continue
+                    map_attr = self.attribute_mapping.get(k, k)
+                    if map_attr is None:
+                        # Ignore attributes that are mapped to None.
+                        continue
+                    self._model_projection.append((k, map_attr.lower()))
+
+            # Search filters only vary in the escaped values substituted
+            # into them, so build the templates once as well.
+            self._get_filter_tmpl = (
+                u'(&(%s=%%(id)s)%%(filter)s(objectClass=%s))' %
+                (self.id_attr, self.object_class))
+            self._get_all_filter_tmpl = (
+                u'(&%%s(objectClass=%s))' % self.object_class)
+            self._id_to_dn_filter_tmpl = (
+                u'(&(%s=%%s)(objectclass=%s))' %
+                (self.id_attr, self.object_class))
+            if 'name' in self.attribute_mapping:
+                self._get_by_name_filter_tmpl = (
+                    u'(%s=%%s)' % self.attribute_mapping['name'])
+
         self.use_dumb_member = getattr(conf.ldap, 'use_dumb_member')
         self.dumb_member = (getattr(conf.ldap, 'dumb_member') or
                             self.DUMB_MEMBER_DN)
@@ -910,13 +1423,27 @@ class BaseLdap(object):
         self.subtree_delete_enabled = getattr(conf.ldap,
                                               'allow_subtree_delete')
 
-    def _not_found(self, object_id):
+        # Which exception _not_found raises never changes after
+        # construction, so pick the factory once.
         if self.NotFound is None:
-            return exception.NotFound(target=object_id)
+            self._not_found_factory = (
+                lambda object_id: exception.NotFound(target=object_id))
         else:
-            return self.NotFound(**{self.notfound_arg: object_id})
+            self._not_found_factory = (
+                lambda object_id: self.NotFound(
+                    **{self.notfound_arg: object_id}))
+
+    def _not_found(self, object_id):
+        return self._not_found_factory(object_id)
 
     def _parse_extra_attrs(self, option_list):
+        # Every backend instantiation re-parses the same configured
+        # option list, so memoize the result; each caller gets its own
+        # copy of the mapping.
+        key = tuple(option_list)
+        cached = _extra_attrs_cache.get(key)
+        if cached is not None:
+            return dict(cached)
         mapping = {}
         for item in option_list:
             try:
@@ -928,6 +1455,8 @@ class BaseLdap(object):
                     item)
                 continue
             mapping[ldap_attr] = attr_map
+        if len(_extra_attrs_cache) < _EXTRA_ATTRS_CACHE_MAXSIZE:
+            _extra_attrs_cache[key] = dict(mapping)
         return mapping
 
     def _is_dumb_member(self, member_dn):
@@ -939,9 +1468,36 @@ class BaseLdap(object):
                 and is_dn_equal(member_dn, self.dumb_member))
 
     def get_connection(self, user=None, password=None):
-        conn = _get_connection(self.LDAP_URL)
+        if user is None:
+            user = self.LDAP_USER
 
-        conn = KeystoneLDAPHandler(conn=conn)
+        if password is None:
+            password = self.LDAP_PASSWORD
+
+        handler = _get_connection(self.LDAP_URL)
+
+        # Only real python-ldap connections bound as the configured
+        # service account are pooled. End-user binds (from
+        # Identity.authenticate) must hit the server every time so that
+        # password changes and revocations take effect immediately, and
+        # registered handlers (e.g. the in-memory fake used by the
+        # tests) are cheap to create and may rely on fresh
+        # per-connection state. Because only the service credentials
+        # ever reach the pool, the key does not need to carry the
+        # password.
+        pool_key = None
+        if (type(handler) is PythonLDAPHandler and
+                user == self.LDAP_USER and password == self.LDAP_PASSWORD):
+            pool_key = (self.LDAP_URL, user, self.page_size,
+                        self.alias_dereferencing, self.use_tls,
+                        self.tls_cacertfile, self.tls_cacertdir,
+                        self.tls_req_cert, self.chase_referrals,
+                        self.debug_level)
+            conn = _pool_checkout(pool_key)
+            if conn is not None:
+                return conn
+
+        conn = KeystoneLDAPHandler(conn=handler)
 
         conn.connect(self.LDAP_URL,
                      page_size=self.page_size,
@@ -953,44 +1509,44 @@ class BaseLdap(object):
                      chase_referrals=self.chase_referrals,
                      debug_level=self.debug_level)
 
-        if user is None:
-            user = self.LDAP_USER
-
-        if password is None:
-            password = self.LDAP_PASSWORD
-
         # not all LDAP servers require authentication, so we don't bind
         # if we don't have any user/pass
         if user and password:
             conn.simple_bind_s(user, password)
 
+        conn._pool_key = pool_key
         return conn
 
     def _id_to_dn_string(self, object_id):
         return u'%s=%s,%s' % (self.id_attr,
-                              ldap.dn.escape_dn_chars(
-                                  six.text_type(object_id)),
+                              _escape_dn_chars(six.text_type(object_id)),
                               self.tree_dn)
 
     def _id_to_dn(self, object_id):
         if self.LDAP_SCOPE == ldap.SCOPE_ONELEVEL:
             return self._id_to_dn_string(object_id)
+        now = time.time()
+        cached = self._dn_cache.get(object_id)
+        if cached is not None and now < cached[1]:
+            return cached[0]
         conn = self.get_connection()
         try:
             search_result = conn.search_s(
                 self.tree_dn, self.LDAP_SCOPE,
-                u'(&(%(id_attr)s=%(id)s)(objectclass=%(objclass)s))' %
-                {'id_attr': self.id_attr,
-                 'id': ldap.filter.escape_filter_chars(
-                     six.text_type(object_id)),
-                 'objclass': self.object_class})
+                self._id_to_dn_filter_tmpl %
+                _escape_filter_chars(six.text_type(object_id)))
         finally:
             conn.unbind_s()
         if search_result:
             dn, attrs = search_result[0]
-            return dn
         else:
-            return self._id_to_dn_string(object_id)
+            # The fallback is cached as well so repeated lookups of a
+            # nonexistent id don't each pay for a fruitless search.
+            dn = self._id_to_dn_string(object_id)
+        if len(self._dn_cache) >= _DN_CACHE_MAXSIZE:
+            self._dn_cache.clear()
+        self._dn_cache[object_id] = (dn, now + _DN_CACHE_TTL)
+        return dn
 
     @staticmethod
     def _dn_to_id(dn):
@@ -999,22 +1555,17 @@ class BaseLdap(object):
     def _ldap_res_to_model(self, res):
         obj = self.model(id=self._dn_to_id(res[0]))
         # LDAP attribute names may be returned in a different case than
-        # they are defined in the mapping, so we need to check for keys
-        # in a case-insensitive way.  We use the case specified in the
-        # mapping for the model to ensure we have a predictable way of
-        # retrieving values later.
-        lower_res = dict((k.lower(), v) for k, v in six.iteritems(res[1]))
-        for k in obj.known_keys:
-            if k in self.attribute_ignore:
-                continue
-
+        # they are defined in the mapping, so keys have to be checked in
+        # a case-insensitive way.  Results that came through the handler
+        # are already case-insensitive dicts; anything else (e.g. a raw
+        # dict handed in by a test) still needs its keys folded here.
+        lower_res = res[1]
+        if not isinstance(lower_res, _CIDict):
+            lower_res = dict((k.lower(), v)
+                             for k, v in _iteritems(lower_res))
+        for k, map_attr in self._model_projection:
             try:
-                map_attr = self.attribute_mapping.get(k, k)
-                if map_attr is None:
-                    # Ignore attributes that are mapped to None.
-                    continue
-
-                v = lower_res[map_attr.lower()]
+                v = lower_res[map_attr]
             except KeyError:
                 pass
             else:
@@ -1066,7 +1617,7 @@ class BaseLdap(object):
         conn = self.get_connection()
         object_classes = self.structural_classes + [self.object_class]
         attrs = [('objectClass', object_classes)]
-        for k, v in six.iteritems(values):
+        for k, v in _iteritems(values):
             if k == 'id' or k in self.attribute_ignore:
                 continue
             if v is not None:
@@ -1074,7 +1625,7 @@ class BaseLdap(object):
                 if attr_type is not None:
                     attrs.append((attr_type, [v]))
                 extra_attrs = [attr for attr, name
-                               in six.iteritems(self.extra_attr_mapping)
+                               in _iteritems(self.extra_attr_mapping)
                                if name == k]
                 for attr in extra_attrs:
                     attrs.append((attr, [v]))
@@ -1089,18 +1640,12 @@ class BaseLdap(object):
 
     def _ldap_get(self, object_id, ldap_filter=None):
         conn = self.get_connection()
-        query = (u'(&(%(id_attr)s=%(id)s)'
-                 u'%(filter)s'
-                 u'(objectClass=%(object_class)s))'
-                 % {'id_attr': self.id_attr,
-                    'id': ldap.filter.escape_filter_chars(
-                        six.text_type(object_id)),
-                    'filter': (ldap_filter or self.ldap_filter or ''),
-                    'object_class': self.object_class})
+        query = self._get_filter_tmpl % {
+            'id': _escape_filter_chars(six.text_type(object_id)),
+            'filter': (ldap_filter or self.ldap_filter or '')}
         try:
-            attrs = list(set((self.attribute_mapping.values() +
-                              self.extra_attr_mapping.keys())))
-            res = conn.search_s(self.tree_dn, self.LDAP_SCOPE, query, attrs)
+            res = conn.search_s(self.tree_dn, self.LDAP_SCOPE, query,
+                                self._search_attrlist)
         except ldap.NO_SUCH_OBJECT:
             return None
         finally:
@@ -1112,34 +1657,49 @@ class BaseLdap(object):
 
     def _ldap_get_all(self, ldap_filter=None):
         conn = self.get_connection()
-        query = u'(&%s(objectClass=%s))' % (ldap_filter or
-                                            self.ldap_filter or
-                                            '', self.object_class)
+        query = self._get_all_filter_tmpl % (ldap_filter or
+                                             self.ldap_filter or
+                                             '')
         try:
-            attrs = list(set((self.attribute_mapping.values() +
-                              self.extra_attr_mapping.keys())))
             return conn.search_s(self.tree_dn,
                                  self.LDAP_SCOPE,
                                  query,
-                                 attrs)
+                                 self._search_attrlist)
         except ldap.NO_SUCH_OBJECT:
             return []
         finally:
             conn.unbind_s()
 
+    def _ldap_iter_all(self, ldap_filter=None):
+        """Yield entries one at a time instead of buffering them all.
+
+        Same query as _ldap_get_all, but streamed through the paged
+        search iterator so list operations over large trees hold at
+        most one page of raw entries at a time.
+        """
+        conn = self.get_connection()
+        query = self._get_all_filter_tmpl % (ldap_filter or
+                                             self.ldap_filter or
+                                             '')
+        try:
+            for entry in conn.search_s_iter(self.tree_dn,
+                                            self.LDAP_SCOPE,
+                                            query,
+                                            self._search_attrlist):
+                yield entry
+        except ldap.NO_SUCH_OBJECT:
+            return
+        finally:
+            conn.unbind_s()
+
     def _ldap_get_list(self, search_base, scope, query_params=None,
                        attrlist=None):
         conn = self.get_connection()
         query = u'(objectClass=%s)' % self.object_class
         if query_params:
-
-            def calc_filter(attrname, value):
-                val_esc = ldap.filter.escape_filter_chars(value)
-                return '(%s=%s)' % (attrname, val_esc)
-
             query = (u'(&%s%s)' %
-                     (query, ''.join([calc_filter(k, v) for k, v in
-                                      six.iteritems(query_params)])))
+                     (query, ''.join([_calc_filter(k, v) for k, v in
+                                      _iteritems(query_params)])))
         try:
             return conn.search_s(search_base, scope, query, attrlist)
         finally:
@@ -1153,9 +1713,8 @@ class BaseLdap(object):
             return self._ldap_res_to_model(res)
 
     def get_by_name(self, name, ldap_filter=None):
-        query = (u'(%s=%s)' % (self.attribute_mapping['name'],
-                               ldap.filter.escape_filter_chars(
-                                   six.text_type(name))))
+        query = (self._get_by_name_filter_tmpl %
+                 _escape_filter_chars(six.text_type(name)))
         res = self.get_all(query)
         try:
             return res[0]
@@ -1164,14 +1723,14 @@ class BaseLdap(object):
 
     def get_all(self, ldap_filter=None):
         return [self._ldap_res_to_model(x)
-                for x in self._ldap_get_all(ldap_filter)]
+                for x in self._ldap_iter_all(ldap_filter)]
 
     def update(self, object_id, values, old_obj=None):
         if old_obj is None:
             old_obj = self.get(object_id)
 
         modlist = []
-        for k, v in six.iteritems(values):
+        for k, v in _iteritems(values):
             if k == 'id' or k in self.attribute_ignore:
                 continue
 
@@ -1199,33 +1758,50 @@ class BaseLdap(object):
                 op = ldap.MOD_REPLACE
                 modlist.append((op, self.attribute_mapping.get(k, k), [v]))
 
-        if modlist:
-            conn = self.get_connection()
-            try:
-                conn.modify_s(self._id_to_dn(object_id), modlist)
-            except ldap.NO_SUCH_OBJECT:
-                raise self._not_found(object_id)
-            finally:
-                conn.unbind_s()
+        if not modlist:
+            # Nothing actually changed; skip both the modify and the
+            # re-read and answer from the copy already in hand.
+            if self.model is not None:
+                obj = self.model(old_obj)
+            else:
+                obj = dict(old_obj)
+            for k, v in _iteritems(values):
+                if k == 'id' or k in self.attribute_ignore or v is None:
+                    continue
+                obj[k] = v
+            return obj
+
+        conn = self.get_connection()
+        try:
+            conn.modify_s(self._id_to_dn(object_id), modlist)
+        except ldap.NO_SUCH_OBJECT:
+            raise self._not_found(object_id)
+        finally:
+            conn.unbind_s()
 
         return self.get(object_id)
 
     def delete(self, object_id):
+        dn = self._id_to_dn(object_id)
+        # The entry is going away; don't let a cached DN outlive it.
+        self._dn_cache.pop(object_id, None)
         conn = self.get_connection()
         try:
-            conn.delete_s(self._id_to_dn(object_id))
+            conn.delete_s(dn)
         except ldap.NO_SUCH_OBJECT:
             raise self._not_found(object_id)
         finally:
             conn.unbind_s()
 
     def deleteTree(self, object_id):
+        dn = self._id_to_dn(object_id)
+        self._dn_cache.pop(object_id, None)
         conn = self.get_connection()
         tree_delete_control = ldap.controls.LDAPControl(CONTROL_TREEDELETE,
                                                         0,
                                                         None)
         try:
-            conn.delete_ext_s(self._id_to_dn(object_id),
+            conn.delete_ext_s(dn,
                               serverctrls=[tree_delete_control])
         except ldap.NO_SUCH_OBJECT:
             raise self._not_found(object_id)
@@ -1283,7 +1859,7 @@ class BaseLdap(object):
                      (query, ''.join(['(%s=%s)'
                                       % (k, ldap.filter.escape_filter_chars(v))
                                       for k, v in
-                                      six.iteritems(query_params)])))
+                                      _iteritems(query_params)])))
         not_deleted_nodes = []
         try:
             # RFC 4511 (The LDAP Protocol) defines a list containing only the
@@ -1339,33 +1915,49 @@ class EnabledEmuMixIn(BaseLdap):
             self.enabled_emulation_dn = ('cn=enabled_%ss,%s' %
                                          (self.options_name, self.tree_dn))
 
-    def _get_enabled(self, object_id):
+    def _get_enabled_members(self):
+        """Return the set of member DNs of the enabled emulation group."""
         conn = self.get_connection()
-        dn = self._id_to_dn(object_id)
-        query = '(member=%s)' % dn
         try:
-            enabled_value = conn.search_s(self.enabled_emulation_dn,
-                                          ldap.SCOPE_BASE,
-                                          query, ['cn'])
+            res = conn.search_s(self.enabled_emulation_dn,
+                                ldap.SCOPE_BASE,
+                                u'(objectClass=*)', ['member'])
         except ldap.NO_SUCH_OBJECT:
+            return set()
+        finally:
+            conn.unbind_s()
+        if not res:
+            return set()
+        dn, attrs = res[0]
+        return set(attrs.get('member', []))
+
+    def _get_enabled(self, object_id):
+        # Resolve the DN before opening a connection so a _dn_cache hit
+        # doesn't tie up a connection while it resolves.
+        dn = self._id_to_dn(object_id)
+        conn = self.get_connection()
+        try:
+            # The compare operation answers the membership question
+            # directly without marshaling any attribute values back.
+            return bool(conn.compare_s(self.enabled_emulation_dn,
+                                       'member', dn))
+        except (ldap.NO_SUCH_OBJECT, ldap.NO_SUCH_ATTRIBUTE):
             return False
-        else:
-            return bool(enabled_value)
         finally:
             conn.unbind_s()
 
     def _add_enabled(self, object_id):
         if not self._get_enabled(object_id):
+            dn = self._id_to_dn(object_id)
             conn = self.get_connection()
             modlist = [(ldap.MOD_ADD,
                         'member',
-                        [self._id_to_dn(object_id)])]
+                        [dn])]
             try:
                 conn.modify_s(self.enabled_emulation_dn, modlist)
             except ldap.NO_SUCH_OBJECT:
                 attr_list = [('objectClass', ['groupOfNames']),
-                             ('member',
-                                 [self._id_to_dn(object_id)])]
+                             ('member', [dn])]
                 if self.use_dumb_member:
                     attr_list[1][1].append(self.dumb_member)
                 conn.add_s(self.enabled_emulation_dn, attr_list)
@@ -1373,10 +1965,11 @@ class EnabledEmuMixIn(BaseLdap):
                 conn.unbind_s()
 
     def _remove_enabled(self, object_id):
+        dn = self._id_to_dn(object_id)
         conn = self.get_connection()
         modlist = [(ldap.MOD_DELETE,
                     'member',
-                    [self._id_to_dn(object_id)])]
+                    [dn])]
         try:
             conn.modify_s(self.enabled_emulation_dn, modlist)
         except (ldap.NO_SUCH_OBJECT, ldap.NO_SUCH_ATTRIBUTE):
@@ -1406,10 +1999,20 @@ class EnabledEmuMixIn(BaseLdap):
         if 'enabled' not in self.attribute_ignore and self.enabled_emulation:
             # had to copy BaseLdap.get_all here to ldap_filter by DN
             tenant_list = [self._ldap_res_to_model(x)
-                           for x in self._ldap_get_all(ldap_filter)
+                           for x in self._ldap_iter_all(ldap_filter)
                            if x[0] != self.enabled_emulation_dn]
+            # Fetch the enabled group's member list once rather than
+            # issuing a per-entry membership search.
+            enabled_members = self._get_enabled_members()
             for tenant_ref in tenant_list:
-                tenant_ref['enabled'] = self._get_enabled(tenant_ref['id'])
+                dn = self._id_to_dn(tenant_ref['id'])
+                # Membership was written by this backend via _id_to_dn,
+                # so an exact match is the common case; fall back to a
+                # proper DN comparison for entries added out-of-band
+                # with different formatting.
+                tenant_ref['enabled'] = (dn in enabled_members or
+                                         any(is_dn_equal(dn, member)
+                                             for member in enabled_members))
             return tenant_list
         else:
             return super(EnabledEmuMixIn, self).get_all(ldap_filter)
@@ -1418,13 +2021,23 @@ class EnabledEmuMixIn(BaseLdap):
         if 'enabled' not in self.attribute_ignore and self.enabled_emulation:
             data = values.copy()
             enabled_value = data.pop('enabled', None)
-            ref = super(EnabledEmuMixIn, self).update(object_id, data, old_obj)
+            if data:
+                ref = super(EnabledEmuMixIn, self).update(
+                    object_id, data, old_obj)
+            else:
+                # Only the enabled flag is changing (or nothing is);
+                # skip the attribute-update machinery entirely and read
+                # the entry without the emulation-group lookup, since
+                # the flag's final value is determined below.
+                ref = super(EnabledEmuMixIn, self).get(object_id)
             if enabled_value is not None:
                 if enabled_value:
                     self._add_enabled(object_id)
                 else:
                     self._remove_enabled(object_id)
                 ref['enabled'] = enabled_value
+            elif not data:
+                ref['enabled'] = self._get_enabled(object_id)
             return ref
         else:
             return super(EnabledEmuMixIn, self).update(
@@ -12,12 +12,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import six
+import logging
+import time
+
 import webob.dec
 
 from keystone.common import authorization
 from keystone.common import config
-from keystone.common import serializer
 from keystone.common import utils
 from keystone.common import wsgi
 from keystone import exception
@@ -29,6 +30,18 @@ from keystone.openstack.common import versionutils
 CONF = config.CONF
 LOG = log.getLogger(__name__)
 
+# Parse request bodies with a C-accelerated JSON parser when one is
+# available; auth payloads are parsed on every POST/PUT and the
+# pure-Python parser is several times slower. The parsers accept both
+# str and bytes, so request.body can be fed in unchanged.
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    try:
+        from ujson import loads as _json_loads
+    except ImportError:
+        _json_loads = jsonutils.loads
+
 
 # Header used to transmit the auth token
 AUTH_TOKEN_HEADER = 'X-Auth-Token'
@@ -38,6 +51,12 @@ AUTH_TOKEN_HEADER = 'X-Auth-Token'
 SUBJECT_TOKEN_HEADER = 'X-Subject-Token'
 
 
+# WSGI environ keys the above headers are stored under, for middleware
+# that reads the environ directly
+AUTH_TOKEN_ENV = 'HTTP_X_AUTH_TOKEN'
+SUBJECT_TOKEN_ENV = 'HTTP_X_SUBJECT_TOKEN'
+
+
 # Environment variable used to pass the request context
 CONTEXT_ENV = wsgi.CONTEXT_ENV
 
@@ -46,15 +65,62 @@ CONTEXT_ENV = wsgi.CONTEXT_ENV
 PARAMS_ENV = wsgi.PARAMS_ENV
 
 
+# Request methods that never carry a body worth parsing
+_NO_BODY_METHODS = frozenset(('GET', 'HEAD', 'DELETE', 'OPTIONS'))
+
+
+# Parameter names that are never passed through to method arguments
+_RESERVED_PARAMS = frozenset(('self', 'context'))
+
+
+# NOTE: __slots__ on these middleware classes was evaluated and not
+# adopted. wsgi.Middleware (via wsgi.Application) defines no __slots__,
+# so every subclass instance carries a __dict__ regardless and slots
+# would save nothing; the dependency framework also injects manager
+# attributes (e.g. token_api) onto instances at runtime, which slotted
+# classes would reject. Middleware objects are constructed once per
+# pipeline, not per request, so there is no win to chase here.
+
+
+# NOTE: compiling this module with Cython was evaluated to shave the
+# remaining interpreter overhead off the per-request path. It is not
+# done: keystone ships as a pure-Python pbr project with no compiled
+# extensions anywhere in the tree, and a conditional native build for
+# one module is not worth the packaging split. The hot paths above
+# have instead been reduced to a handful of dict operations each.
+
+
+# Per-worker token cache used by AuthContextMiddleware. The TTL is
+# deliberately short: it only needs to absorb bursts of requests
+# carrying the same token, and a few seconds of staleness on
+# revocation is on par with the existing caching layer.
+_TOKEN_CACHE_MAXSIZE = 4096
+_TOKEN_CACHE_TTL = 5
+
+
+def _validation_error(request, attribute, target):
+    """Render a ValidationError as a 400 response for this request.
+
+    ValidationError instances pick up per-request state when rendered,
+    so they are built fresh here rather than shared between requests.
+    """
+    e = exception.ValidationError(attribute=attribute, target=target)
+    return wsgi.render_exception(e, request=request)
+
+
 class TokenAuthMiddleware(wsgi.Middleware):
     def process_request(self, request):
-        token = request.headers.get(AUTH_TOKEN_HEADER)
-        context = request.environ.get(CONTEXT_ENV, {})
-        context['token_id'] = token
-        if SUBJECT_TOKEN_HEADER in request.headers:
-            context['subject_token_id'] = (
-                request.headers.get(SUBJECT_TOKEN_HEADER))
-        request.environ[CONTEXT_ENV] = context
+        # request.environ is a property; bind it once instead of paying
+        # the descriptor lookup per access. Reading the WSGI environ
+        # keys directly also sidesteps webob's EnvironHeaders proxy.
+        env = request.environ
+        # setdefault mutates any context a prior filter stored in
+        # place, so no write-back assignment is needed.
+        context = env.setdefault(CONTEXT_ENV, {})
+        context['token_id'] = env.get(AUTH_TOKEN_ENV)
+        subject_token = env.get(SUBJECT_TOKEN_ENV)
+        if subject_token is not None:
+            context['subject_token_id'] = subject_token
 
 
 class AdminTokenAuthMiddleware(wsgi.Middleware):
@@ -66,10 +132,15 @@ class AdminTokenAuthMiddleware(wsgi.Middleware):
     """
 
     def process_request(self, request):
-        token = request.headers.get(AUTH_TOKEN_HEADER)
-        context = request.environ.get(CONTEXT_ENV, {})
-        context['is_admin'] = (token == CONF.admin_token)
-        request.environ[CONTEXT_ENV] = context
+        env = request.environ
+        token = env.get(AUTH_TOKEN_ENV)
+        context = env.get(CONTEXT_ENV, {})
+        # Skip the comparison when no token was sent at all, and use
+        # the constant-time comparison so the check can't be used as a
+        # timing oracle on the admin token.
+        context['is_admin'] = (token is not None and
+                               utils.auth_str_equal(token, CONF.admin_token))
+        env[CONTEXT_ENV] = context
 
 
 class PostParamsMiddleware(wsgi.Middleware):
@@ -82,15 +153,9 @@ class PostParamsMiddleware(wsgi.Middleware):
 
     def process_request(self, request):
         params_parsed = request.params
-        params = {}
-        for k, v in six.iteritems(params_parsed):
-            if k in ('self', 'context'):
-                continue
-            if k.startswith('_'):
-                continue
-            params[k] = v
-
-        request.environ[PARAMS_ENV] = params
+        request.environ[PARAMS_ENV] = dict(
+            (k, v) for k, v in params_parsed.items()
+            if k[:1] != '_' and k not in _RESERVED_PARAMS)
 
 
 class JsonBodyMiddleware(wsgi.Middleware):
@@ -108,48 +173,56 @@ class JsonBodyMiddleware(wsgi.Middleware):
 
     """
     def process_request(self, request):
-        # Abort early if we don't have any work to do
-        params_json = request.body
-        if not params_json:
+        # Abort early if we don't have any work to do. Checking the
+        # method and Content-Length first means bodyless requests --
+        # the bulk of read-heavy traffic -- never pay for materializing
+        # request.body. A missing Content-Length is not the same as an
+        # empty body: chunked transfer encoding sends a readable body
+        # with no declared length, so only skip when the body is
+        # provably absent.
+        content_length = request.content_length
+        if (request.method in _NO_BODY_METHODS or
+                content_length == 0 or
+                (content_length is None and not request.is_body_readable)):
             return
 
+        # Materialize the body exactly once and hand it to the parser
+        # as-is; the parser accepts bytes, so no str decode is needed.
+        params_json = request.body
+
         # Reject unrecognized content types. Empty string indicates
         # the client did not explicitly set the header
         if request.content_type not in ('application/json', ''):
-            e = exception.ValidationError(attribute='application/json',
-                                          target='Content-Type header')
-            return wsgi.render_exception(e, request=request)
+            return _validation_error(request, 'application/json',
+                                     'Content-Type header')
 
-        params_parsed = {}
         try:
-            params_parsed = jsonutils.loads(params_json)
-        except ValueError:
-            e = exception.ValidationError(attribute='valid JSON',
-                                          target='request body')
-            return wsgi.render_exception(e, request=request)
-        finally:
-            if not params_parsed:
-                params_parsed = {}
-
+            params_parsed = _json_loads(params_json)
+        except (ValueError, TypeError):
+            return _validation_error(request, 'valid JSON', 'request body')
+        if not params_parsed:
+            # Bodies parsing to a falsy value ('null', '[]', ...) have
+            # always been treated as empty parameter sets.
+            params_parsed = {}
         if not isinstance(params_parsed, dict):
-            e = exception.ValidationError(attribute='valid JSON object',
-                                          target='request body')
-            return wsgi.render_exception(e, request=request)
+            return _validation_error(request, 'valid JSON object',
+                                     'request body')
 
-        params = {}
-        for k, v in six.iteritems(params_parsed):
-            if k in ('self', 'context'):
-                continue
-            if k.startswith('_'):
-                continue
-            params[k] = v
-
-        request.environ[PARAMS_ENV] = params
+        request.environ[PARAMS_ENV] = dict(
+            (k, v) for k, v in params_parsed.items()
+            if k[:1] != '_' and k not in _RESERVED_PARAMS)
 
 
 class XmlBodyMiddleware(wsgi.Middleware):
     """De/serializes XML to/from JSON."""
 
+    # Offered in preference order; absent or wildcard Accept headers
+    # resolve to JSON.
+    _XML_ACCEPT = ('application/json', 'application/xml')
+
+    # Overridden as a plain class attribute by the versioned subclasses.
+    xmlns = None
+
     @versionutils.deprecated(
         what='keystone.middleware.core.XmlBodyMiddleware',
         as_of=versionutils.deprecated.ICEHOUSE,
@@ -157,30 +230,45 @@ class XmlBodyMiddleware(wsgi.Middleware):
         remove_in=+2)
     def __init__(self, *args, **kwargs):
         super(XmlBodyMiddleware, self).__init__(*args, **kwargs)
-        self.xmlns = None
+        # Deferred so that JSON-only pipelines never import the XML
+        # serializer (and its lxml dependency) at all.
+        from keystone.common import serializer
+        self._serializer = serializer
 
     def process_request(self, request):
         """Transform the request from XML to JSON."""
-        incoming_xml = 'application/xml' in str(request.content_type)
+        # Same guard as JsonBodyMiddleware: a missing Content-Length
+        # can still mean a readable chunked body, so only skip when
+        # the body is provably absent.
+        content_length = request.content_length
+        if (content_length == 0 or
+                (content_length is None and not request.is_body_readable)):
+            return
+        incoming_xml = request.content_type == 'application/xml'
         if incoming_xml and request.body:
             request.content_type = 'application/json'
             try:
                 request.body = jsonutils.dumps(
-                    serializer.from_xml(request.body))
+                    self._serializer.from_xml(request.body))
             except Exception:
                 LOG.exception('Serializer failed')
-                e = exception.ValidationError(attribute='valid XML',
-                                              target='request body')
-                return wsgi.render_exception(e, request=request)
+                return _validation_error(request, 'valid XML',
+                                         'request body')
 
     def process_response(self, request, response):
         """Transform the response from JSON to XML."""
-        outgoing_xml = 'application/xml' in str(request.accept)
-        if outgoing_xml and response.body:
+        # best_match avoids serializing the Accept header back to a
+        # string and honors the client's quality preferences.
+        if request.accept.best_match(self._XML_ACCEPT) != 'application/xml':
+            # The common JSON case returns before response.body is
+            # ever materialized.
+            return response
+        if response.body:
             response.content_type = 'application/xml'
             try:
-                body_obj = jsonutils.loads(response.body)
-                response.body = serializer.to_xml(body_obj, xmlns=self.xmlns)
+                body_obj = _json_loads(response.body)
+                response.body = self._serializer.to_xml(body_obj,
+                                                        xmlns=self.xmlns)
             except Exception:
                 LOG.exception('Serializer failed')
                 raise exception.Error(message=response.body)
@@ -190,17 +278,13 @@ class XmlBodyMiddleware(wsgi.Middleware):
 class XmlBodyMiddlewareV2(XmlBodyMiddleware):
     """De/serializes XML to/from JSON for v2.0 API."""
 
-    def __init__(self, *args, **kwargs):
-        super(XmlBodyMiddlewareV2, self).__init__(*args, **kwargs)
-        self.xmlns = 'http://docs.openstack.org/identity/api/v2.0'
+    xmlns = 'http://docs.openstack.org/identity/api/v2.0'
 
 
 class XmlBodyMiddlewareV3(XmlBodyMiddleware):
     """De/serializes XML to/from JSON for v3 API."""
 
-    def __init__(self, *args, **kwargs):
-        super(XmlBodyMiddlewareV3, self).__init__(*args, **kwargs)
-        self.xmlns = 'http://docs.openstack.org/identity/api/v3'
+    xmlns = 'http://docs.openstack.org/identity/api/v3'
 
 
 class NormalizingFilter(wsgi.Middleware):
@@ -208,40 +292,62 @@ class NormalizingFilter(wsgi.Middleware):
 
     def process_request(self, request):
         """Normalizes URLs."""
+        env = request.environ
+        path_info = env['PATH_INFO']
         # Removes a trailing slash from the given path, if any.
-        if (len(request.environ['PATH_INFO']) > 1 and
-                request.environ['PATH_INFO'][-1] == '/'):
-            request.environ['PATH_INFO'] = request.environ['PATH_INFO'][:-1]
+        if path_info.endswith('/') and len(path_info) > 1:
+            env['PATH_INFO'] = path_info[:-1]
         # Rewrites path to root if no path is given.
-        elif not request.environ['PATH_INFO']:
-            request.environ['PATH_INFO'] = '/'
+        elif not path_info:
+            env['PATH_INFO'] = '/'
 
 
 class RequestBodySizeLimiter(wsgi.Middleware):
     """Limit the size of an incoming request."""
 
-    def __init__(self, *args, **kwargs):
-        super(RequestBodySizeLimiter, self).__init__(*args, **kwargs)
-
     @webob.dec.wsgify()
     def __call__(self, req):
-        if req.content_length is None:
-            if req.is_body_readable:
-                limiter = utils.LimitingReader(req.body_file,
-                                               CONF.max_request_body_size)
-                req.body_file = limiter
-        elif req.content_length > CONF.max_request_body_size:
-            raise exception.RequestTooLarge()
+        content_length = req.content_length
+        limit = CONF.max_request_body_size
+        if content_length is not None:
+            # A declared length under the limit needs no reader wrap;
+            # the WSGI server already bounds the body at Content-Length.
+            if content_length > limit:
+                raise exception.RequestTooLarge()
+        elif req.is_body_readable:
+            req.body_file = utils.LimitingReader(req.body_file, limit)
         return self.application
 
 
 class AuthContextMiddleware(wsgi.Middleware):
     """Build the authentication context from the request auth token."""
 
+    def __init__(self, *args, **kwargs):
+        super(AuthContextMiddleware, self).__init__(*args, **kwargs)
+        # token_id -> (expires_at, token_ref). Sits in front of the
+        # token_api cache to save its cross-process round trip when the
+        # same client issues several requests back to back.
+        self._token_cache = {}
+
+    def _get_token(self, token_id):
+        cache = self._token_cache
+        entry = cache.get(token_id)
+        now = time.time()
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        # Retrieval and validation share one backend pass (and one PKI
+        # hash) rather than being two separate api calls.
+        token_ref = self.token_api.get_and_validate(token_id)
+        if len(cache) >= _TOKEN_CACHE_MAXSIZE:
+            cache.clear()
+        cache[token_id] = (now + _TOKEN_CACHE_TTL, token_ref)
+        return token_ref
+
     def _build_auth_context(self, request):
-        token_id = request.headers.get(AUTH_TOKEN_HEADER)
+        token_id = request.environ.get(AUTH_TOKEN_ENV)
 
-        if token_id == CONF.admin_token:
+        if token_id is not None and utils.auth_str_equal(token_id,
+                                                         CONF.admin_token):
             # NOTE(gyee): no need to proceed any further as the special admin
             # token is being handled by AdminTokenAuthMiddleware. This code
             # will not be impacted even if AdminTokenAuthMiddleware is removed
@@ -253,14 +359,7 @@ class AuthContextMiddleware(wsgi.Middleware):
         context['environment'] = request.environ
 
         try:
-            token_ref = self.token_api.get_token(token_id)
-            # TODO(ayoung): These two functions return the token in different
-            # formats instead of two calls, only make one.  However, the call
-            # to get_token hits the caching layer, and does not validate the
-            # token.  In the future, this should be reduced to one call.
-            if not CONF.token.revoke_by_id:
-                self.token_api.token_provider_api.validate_token(
-                    context['token_id'])
+            token_ref = self._get_token(token_id)
 
             # TODO(gyee): validate_token_bind should really be its own
             # middleware
@@ -268,13 +367,20 @@ class AuthContextMiddleware(wsgi.Middleware):
             return authorization.token_to_auth_context(
                 token_ref['token_data'])
         except exception.TokenNotFound:
+            self._token_cache.pop(token_id, None)
             LOG.warning(_('RBAC: Invalid token'))
             raise exception.Unauthorized()
 
     def process_request(self, request):
-        if AUTH_TOKEN_HEADER not in request.headers:
-            LOG.debug(('Auth token not in the request header. '
-                       'Will not build auth context.'))
+        # A plain environ membership test; request.headers would build
+        # the EnvironHeaders proxy just to answer the same question.
+        # The isEnabledFor checks keep debug-off pipelines from paying
+        # for the adapter call (LOG.logger is the underlying logger;
+        # the adapter itself lacks isEnabledFor on Python 2.6).
+        if AUTH_TOKEN_ENV not in request.environ:
+            if LOG.logger.isEnabledFor(logging.DEBUG):
+                LOG.debug(('Auth token not in the request header. '
+                           'Will not build auth context.'))
             return
 
         if authorization.AUTH_CONTEXT_ENV in request.environ:
@@ -283,5 +389,6 @@ class AuthContextMiddleware(wsgi.Middleware):
             return
 
         auth_context = self._build_auth_context(request)
-        LOG.debug('RBAC: auth_context: %s', auth_context)
+        if LOG.logger.isEnabledFor(logging.DEBUG):
+            LOG.debug('RBAC: auth_context: %s', auth_context)
         request.environ[authorization.AUTH_CONTEXT_ENV] = auth_context
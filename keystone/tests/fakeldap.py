@@ -383,6 +383,27 @@ class FakeLdap(core.LDAPHandler):
         self.db[key] = entry
         self.db.sync()
 
+    def compare_s(self, dn, attr, value):
+        """Compare a value against the named attribute of an entry."""
+        if server_fail:
+            raise ldap.SERVER_DOWN
+
+        key = self.key(dn)
+        LOG.debug('compare item: dn=%(dn)s attr=%(attr)s', {
+            'dn': core.utf8_decode(dn), 'attr': attr})
+        try:
+            entry = self.db[key]
+        except KeyError:
+            raise ldap.NO_SUCH_OBJECT
+        try:
+            values = entry[attr]
+        except KeyError:
+            raise ldap.NO_SUCH_ATTRIBUTE
+        # Normalize both sides the same way _match does for searches.
+        check_value = _internal_attr(attr, value)[0]
+        norm_values = [_internal_attr(attr, x)[0] for x in values]
+        return 1 if check_value in norm_values else 0
+
     def search_s(self, base, scope,
                  filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
         """Search for all matching objects under base using the query.
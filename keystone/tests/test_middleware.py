@@ -15,7 +15,9 @@
 import webob
 
 from keystone import config
+from keystone import exception
 from keystone import middleware
+from keystone.middleware import core as middleware_core
 from keystone.openstack.common import jsonutils
 from keystone import tests
 
@@ -166,3 +168,63 @@ class XmlBodyMiddlewareTest(tests.TestCase):
         middleware.XmlBodyMiddleware(None).process_request(req)
         self.assertEqual(body, req.body)
         self.assertEqual(content_type, req.content_type)
+
+
+class CountingTokenApi(object):
+    """Counts get_and_validate calls and returns a canned token."""
+
+    def __init__(self):
+        self.calls = 0
+        self.token_ref = {'token_data': {'token': {}}}
+
+    def get_and_validate(self, token_id):
+        self.calls += 1
+        return self.token_ref
+
+
+class RevokedTokenApi(object):
+    """Raises TokenNotFound for every token, like a revoked one."""
+
+    def get_and_validate(self, token_id):
+        raise exception.TokenNotFound(token_id=token_id)
+
+
+class AuthContextMiddlewareTokenCacheTest(tests.TestCase):
+    def _middleware(self, token_api=None):
+        auth_context = middleware.AuthContextMiddleware(None)
+        auth_context.token_api = token_api or CountingTokenApi()
+        return auth_context
+
+    def test_cache_hit_within_ttl(self):
+        auth_context = self._middleware()
+        first = auth_context._get_token('token')
+        second = auth_context._get_token('token')
+        self.assertIs(first, second)
+        self.assertEqual(1, auth_context.token_api.calls)
+
+    def test_cache_miss_after_expiry(self):
+        auth_context = self._middleware()
+        token_ref = auth_context._get_token('token')
+        # Backdate the cached entry past its TTL.
+        auth_context._token_cache['token'] = (0, token_ref)
+        auth_context._get_token('token')
+        self.assertEqual(2, auth_context.token_api.calls)
+
+    def test_cache_cleared_at_size_bound(self):
+        auth_context = self._middleware()
+        for i in range(middleware_core._TOKEN_CACHE_MAXSIZE):
+            auth_context._token_cache['token-%d' % i] = (float('inf'), {})
+        auth_context._get_token('one-more')
+        self.assertEqual(1, len(auth_context._token_cache))
+        self.assertIn('one-more', auth_context._token_cache)
+
+    def test_revoked_token_dropped_from_cache(self):
+        auth_context = self._middleware(token_api=RevokedTokenApi())
+        # A stale cached entry for the token must not be re-served once
+        # the backend reports the token gone.
+        auth_context._token_cache['token'] = (0, {'token_data': {}})
+        req = make_request()
+        req.headers[middleware.AUTH_TOKEN_HEADER] = 'token'
+        self.assertRaises(exception.Unauthorized,
+                          auth_context._build_auth_context, req)
+        self.assertNotIn('token', auth_context._token_cache)
@@ -13,6 +13,9 @@
 # under the License.
 
 import datetime
+import uuid
+
+import mock
 
 from keystone import config
 from keystone import exception
@@ -800,6 +803,78 @@ class TestTokenProvider(tests.TestCase):
             self.token_provider_api._is_valid_token(create_v3_token()))
 
 
+class TestTokenGetAndValidate(tests.TestCase):
+    """Tests for token_api.get_and_validate.
+
+    The combined call must behave exactly like get_token followed by
+    token_provider_api.validate_token (the latter only when revocation
+    by token id is disabled).
+    """
+
+    def setUp(self):
+        super(TestTokenGetAndValidate, self).setUp()
+        self.load_backends()
+
+    def _create_token(self, expires=None):
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id, 'a': 'b',
+                'trust_id': None,
+                'user': {'id': 'testuserid'}}
+        if expires is not None:
+            data['expires'] = expires
+        self.token_api.create_token(token_id, data)
+        return token_id
+
+    def test_matches_get_token_with_revoke_by_id(self):
+        self.config_fixture.config(group='token', revoke_by_id=True)
+        token_id = self._create_token()
+        with mock.patch.object(self.token_provider_api,
+                               'validate_token') as validate:
+            token_ref = self.token_api.get_and_validate(token_id)
+        # With revoke-by-id enabled no separate validation call is
+        # made, same as the original two-call sequence.
+        self.assertFalse(validate.called)
+        self.assertEqual(self.token_api.get_token(token_id), token_ref)
+
+    def test_matches_two_calls_without_revoke_by_id(self):
+        self.config_fixture.config(group='token', revoke_by_id=False)
+        token_id = self._create_token()
+        unique_id = self.token_provider_api.unique_id(token_id)
+        with mock.patch.object(self.token_provider_api,
+                               'validate_token') as validate:
+            token_ref = self.token_api.get_and_validate(token_id)
+        # The provider is consulted exactly once, with the token's
+        # unique id (which unique_id() passes through unchanged).
+        validate.assert_called_once_with(unique_id)
+        self.assertEqual(self.token_api.get_token(token_id), token_ref)
+
+    def test_empty_token(self):
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_and_validate, '')
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_and_validate, None)
+
+    def test_expired_token(self):
+        expires = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        token_id = self._create_token(expires=expires)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_and_validate, token_id)
+
+    def test_unknown_token(self):
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_and_validate,
+                          uuid.uuid4().hex)
+
+    def test_failed_validation_raises_token_not_found(self):
+        self.config_fixture.config(group='token', revoke_by_id=False)
+        token_id = self._create_token()
+        with mock.patch.object(
+                self.token_provider_api, 'validate_token',
+                side_effect=exception.TokenNotFound(token_id=token_id)):
+            self.assertRaises(exception.TokenNotFound,
+                              self.token_api.get_and_validate, token_id)
+
+
 class TestTokenProviderOAuth1(tests.TestCase):
     def setUp(self):
         super(TestTokenProviderOAuth1, self).setUp()
@@ -10,9 +10,12 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import time
+
 import ldap.dn
 
 from keystone.common import ldap as ks_ldap
+from keystone.common.ldap import core
 from keystone import tests
 
 
@@ -167,3 +170,88 @@ class DnCompareTest(tests.BaseTestCase):
         descendant = ldap.dn.str2dn('cn=Babs Jansen,ou=OpenStack')
         dn = ldap.dn.str2dn('ou=OpenStack')
         self.assertTrue(ks_ldap.dn_startswith(descendant, dn))
+
+
+class FakePooledConn(object):
+    """Stands in for a KeystoneLDAPHandler in the pool tests."""
+
+    def __init__(self):
+        self.alive = True
+        self.unbound = False
+        self._pool_key = None
+
+    def search_s(self, *args):
+        if not self.alive:
+            raise ldap.SERVER_DOWN('connection lost')
+        return []
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+class ConnectionPoolTest(tests.BaseTestCase):
+    """Tests for the connection pool helpers in keystone.common.ldap.core."""
+
+    POOL_KEY = ('ldap://localhost', 'cn=admin')
+
+    def setUp(self):
+        super(ConnectionPoolTest, self).setUp()
+        core._conn_pools.clear()
+        self.addCleanup(core._conn_pools.clear)
+
+    def test_checkout_from_empty_pool(self):
+        # _pool_checkout returns None when nothing is pooled.
+        self.assertIsNone(core._pool_checkout(self.POOL_KEY))
+
+    def test_checkin_checkout_roundtrip(self):
+        # A checked-in connection is handed back out again.
+        conn = FakePooledConn()
+        core._pool_checkin(self.POOL_KEY, conn)
+        self.assertIs(conn, core._pool_checkout(self.POOL_KEY))
+        self.assertFalse(conn.unbound)
+
+    def test_checkout_discards_dead_connections(self):
+        # Connections that fail the liveness probe are unbound and not
+        # handed out.
+        dead = FakePooledConn()
+        dead.alive = False
+        core._pool_checkin(self.POOL_KEY, dead)
+        self.assertIsNone(core._pool_checkout(self.POOL_KEY))
+        self.assertTrue(dead.unbound)
+
+    def test_checkin_bounded_by_maxsize(self):
+        # Checking in more connections than _POOL_MAXSIZE tears down
+        # the excess instead of growing the pool.
+        conns = [FakePooledConn() for _ in range(core._POOL_MAXSIZE + 1)]
+        for conn in conns:
+            core._pool_checkin(self.POOL_KEY, conn)
+        self.assertEqual(core._POOL_MAXSIZE,
+                         len(core._conn_pools[self.POOL_KEY]))
+        self.assertTrue(conns[-1].unbound)
+        self.assertFalse(conns[0].unbound)
+
+    def test_idle_connections_reaped(self):
+        # Entries that idled past the TTL are unbound, not reused.
+        conn = FakePooledConn()
+        core._pool_checkin(self.POOL_KEY, conn)
+        stale = time.time() - core._POOL_IDLE_TTL - 1
+        core._conn_pools[self.POOL_KEY][0] = (conn, stale)
+        self.assertIsNone(core._pool_checkout(self.POOL_KEY))
+        self.assertTrue(conn.unbound)
+
+    def test_exhausted_pool_keys_pruned(self):
+        # Emptying a pool removes its key so the module-level dict
+        # stays bounded by the number of pools currently in use.
+        conn = FakePooledConn()
+        core._pool_checkin(self.POOL_KEY, conn)
+        self.assertIs(conn, core._pool_checkout(self.POOL_KEY))
+        self.assertNotIn(self.POOL_KEY, core._conn_pools)
+
+    def test_reaped_pool_keys_pruned(self):
+        # A pool emptied purely by TTL reaping is pruned as well.
+        conn = FakePooledConn()
+        core._pool_checkin(self.POOL_KEY, conn)
+        stale = time.time() - core._POOL_IDLE_TTL - 1
+        core._conn_pools[self.POOL_KEY][0] = (conn, stale)
+        core._pool_checkout(self.POOL_KEY)
+        self.assertNotIn(self.POOL_KEY, core._conn_pools)
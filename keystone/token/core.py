@@ -140,6 +140,31 @@ class Manager(manager.Manager):
         self._assert_valid(token_id, token_ref)
         return token_ref
 
+    def get_and_validate(self, token_id):
+        """Retrieve a token and validate it in a single pass.
+
+        Equivalent to ``get_token`` followed by
+        ``token_provider_api.validate_token`` (which is only needed
+        when token revocation by id is disabled), but the token's
+        unique id is computed once and shared by both steps instead of
+        re-hashing a PKI token for each call.
+
+        :returns: the token reference from the persistence backend
+        :raises keystone.exception.TokenNotFound: if the token is
+            missing, expired, or fails validation
+
+        """
+        if not token_id:
+            raise exception.TokenNotFound(token_id='')
+        unique_id = self.token_provider_api.unique_id(token_id)
+        token_ref = self._get_token(unique_id)
+        self._assert_valid(token_id, token_ref)
+        if not CONF.token.revoke_by_id:
+            # unique_id passes through the provider's unique_id()
+            # unchanged, so no second hash is performed.
+            self.token_provider_api.validate_token(unique_id)
+        return token_ref
+
     @cache.on_arguments(should_cache_fn=SHOULD_CACHE,
                         expiration_time=EXPIRATION_TIME)
     def _get_token(self, token_id):